@@ -1,32 +1,45 @@
 # backend/app.py
-from typing import List, Optional, Generator
+from typing import List, Optional, AsyncGenerator, BinaryIO, Union
 
 import os
+import asyncio
+import time
+import hashlib
+import io
+import logging
+import queue
+import threading
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 from fastapi import (
+    BackgroundTasks,
     FastAPI,
     Depends,
     HTTPException,
     Header,
+    Request,
     status,
     Query,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel, conint, ConfigDict
 
-from sqlalchemy import select, text, Table, MetaData
-from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, update, bindparam, text, func
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from backend.db import Base, engine, SessionLocal
+from backend.db import Base, AsyncSessionLocal
 from backend.models import (
     Product,
     Inventory,
     Order,
     OrderItem,
     Cafe,
+    CafeUser,
     OrderStatus,
 )
 
@@ -38,8 +51,9 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
 # -------- Auth (bcrypt + JWT) ------
-from passlib.hash import bcrypt
+import bcrypt
 import jwt
+from cachetools import LRUCache, TTLCache
 
 # ================== CONFIG ==================
 APP_TITLE = "Bakery API (MySQL)"
@@ -47,13 +61,50 @@ LOCAL_TZ = ZoneInfo("Asia/Almaty")  # локальное время для PDF
 SECRET_KEY = os.environ.get("JWT_SECRET", "super-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 12 * 60  # 12 часов
+JWT_CACHE_TTL = 10   # сек, кэш проверенных токенов
+USER_CACHE_TTL = 30  # сек, кэш пользователей по id
+LOGIN_MAX_ATTEMPTS = 5          # неудачных попыток на пару login+IP
+LOGIN_MAX_IP_ATTEMPTS = 50      # неудачных попыток с одного IP по любым логинам
+LOGIN_LOCKOUT_SECONDS = 5 * 60  # блокировка после превышения
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INVOICE_DIR = os.path.join(BASE_DIR, "invoices")
 os.makedirs(INVOICE_DIR, exist_ok=True)
 
+logger = logging.getLogger("bakery")
+
+# =============== Logging ===============
+def _setup_logging() -> tuple[QueueHandler, QueueListener]:
+    """
+    Root-логгер пишет в очередь, а в stderr её выгружает фоновый поток —
+    обработчики запросов не блокируются на выводе. Уровень INFO — только для "bakery",
+    чтобы не включать INFO-логи сторонних библиотек.
+    """
+    log_queue: queue.Queue = queue.Queue(-1)
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = QueueListener(log_queue, stream, respect_handler_level=True)
+
+    handler = QueueHandler(log_queue)
+    logging.getLogger().addHandler(handler)
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    listener.start()
+    return handler, listener
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # поток слушателя запускаем в каждом воркере (с --preload потоки мастера не переживают fork)
+    handler, listener = _setup_logging()
+    try:
+        yield
+    finally:
+        # сначала снимаем handler, чтобы записи не копились в очереди остановленного слушателя
+        logging.getLogger().removeHandler(handler)
+        listener.stop()
+
 # =============== FASTAPI APP ===============
-app = FastAPI(title=APP_TITLE)
+app = FastAPI(title=APP_TITLE, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -63,12 +114,51 @@ app.add_middleware(
 )
 
 # =============== DB utils ===============
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+# =============== Statements ===============
+# Горячие запросы собираем один раз при импорте: в обработчиках не строим select() заново,
+# а кэш компиляции SQLAlchemy всегда попадает. Параметры передаются через bindparam.
+_STMT_USER_BY_ID = select(CafeUser).where(CafeUser.id == bindparam("uid"))
+_STMT_USER_BY_LOGIN = select(CafeUser).where(CafeUser.login == bindparam("login"))
+_STMT_CAFE_NAME = select(Cafe.name).where(Cafe.id == bindparam("cafe_id"))
+_STMT_PRODUCTS = (
+    select(
+        Product.id,
+        Product.name,
+        func.coalesce(Product.price, 0).label("price"),
+        func.coalesce(Inventory.qty, 0).label("stock"),
+    )
+    .join(Inventory, Inventory.product_id == Product.id, isouter=True)
+    .order_by(Product.id)
+)
+_STMT_INVOICE_ROWS = (
+    select(Product.name, OrderItem.qty, OrderItem.price)
+    .join(Product, OrderItem.product_id == Product.id)
+    .where(OrderItem.order_id == bindparam("order_id"))
+)
+_ORDER_OF_CAFE = (Order.id == bindparam("order_id"), Order.cafe_id == bindparam("cafe_id"))
+_STMT_ORDER_EXISTS = select(Order.id).where(*_ORDER_OF_CAFE)
+_STMT_ORDER_WITH_ITEMS = select(Order).options(selectinload(Order.items)).where(*_ORDER_OF_CAFE)
+_STMT_ORDER_WITH_PRODUCTS = (
+    select(Order)
+    .options(selectinload(Order.items).joinedload(OrderItem.product))
+    .where(*_ORDER_OF_CAFE)
+)
+_STMT_CONFIRM_ORDER = (
+    update(Order)
+    .where(Order.id == bindparam("order_id"), Order.status == OrderStatus.pending)
+    .values(status=OrderStatus.confirmed)
+    .execution_options(synchronize_session=False)
+)
+_STMT_TAKE_STOCK = (
+    update(Inventory)
+    .where(Inventory.product_id == bindparam("b_product_id"), Inventory.qty >= bindparam("b_qty"))
+    .values(qty=Inventory.qty - bindparam("b_qty"))
+    .execution_options(synchronize_session=False)
+)
 
 # =============== Auth models/Schemas ===============
 class LoginIn(BaseModel):
@@ -85,9 +175,38 @@ class UserOut(BaseModel):
     login: str
     is_admin: bool
 
-# Таблица пользователей кафе (autoload)
-_metadata = MetaData()
-CafeUsers = Table("cafe_users", _metadata, autoload_with=engine)
+# Счётчик неудачных входов по (login, ip): не даём перебором грузить bcrypt.
+# Стоимость хэша (rounds) задаётся при создании хэша: 12 ≈ 250 мс, 10 ≈ 60 мс на проверку —
+# ниже 10 опускать не стоит, это прямо ослабляет защиту от перебора утёкших хэшей.
+# Второй счётчик — по IP: один клиент не может перебирать логины и забить таблицу пар.
+# Записи никогда не вытесняются (иначе спрей мусорными логинами сбрасывал бы лимит
+# атакуемой пары); если счётчик заполнен, новые ключи просто не учитываются, но и не блокируются.
+# Счётчики живут в памяти процесса: у каждого воркера gunicorn свои, так что фактический
+# лимит — LOGIN_MAX_ATTEMPTS × число воркеров.
+_login_failures: TTLCache = TTLCache(maxsize=10000, ttl=LOGIN_LOCKOUT_SECONDS)
+_ip_failures: TTLCache = TTLCache(maxsize=10000, ttl=LOGIN_LOCKOUT_SECONDS)
+
+def _login_blocked(key: tuple) -> bool:
+    return (
+        _login_failures.get(key, 0) >= LOGIN_MAX_ATTEMPTS
+        or _ip_failures.get(key[1], 0) >= LOGIN_MAX_IP_ATTEMPTS
+    )
+
+def _bump_failures(counter: TTLCache, key) -> None:
+    counter.expire()
+    if key in counter or counter.currsize < counter.maxsize:
+        counter[key] = counter.get(key, 0) + 1
+
+def _record_login_failure(key: tuple) -> None:
+    _bump_failures(_login_failures, key)
+    _bump_failures(_ip_failures, key[1])
+
+def verify_password(password: str, password_hash: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+    except ValueError:
+        # битый/не-bcrypt хэш в БД
+        return False
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -95,17 +214,33 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# Кэш успешно проверенных токенов (ключ — sha256 токена) и пользователей (ключ — id).
+# Ошибки проверки не кэшируются. Обращения только из event loop — блокировка не нужна.
+_jwt_cache: TTLCache = TTLCache(maxsize=10000, ttl=JWT_CACHE_TTL)
+_user_cache: TTLCache = TTLCache(maxsize=5000, ttl=USER_CACHE_TTL)
+
 def decode_token(token: str) -> dict:
+    key = hashlib.sha256(token.encode()).hexdigest()
+    now = time.time()
+    payload = _jwt_cache.get(key)
+    # не отдаём из кэша токен, который истёк раньше TTL кэша
+    if payload is not None and payload.get("exp", 0) > now:
+        return payload
+
     try:
-        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def get_current_user(
+    if payload.get("exp", 0) > now:
+        _jwt_cache[key] = payload
+    return payload
+
+async def get_current_user(
     authorization: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> UserOut:
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Missing bearer token")
@@ -115,16 +250,23 @@ def get_current_user(
     if not uid:
         raise HTTPException(status_code=401, detail="Invalid token payload")
 
-    row = db.execute(select(CafeUsers).where(CafeUsers.c.id == int(uid))).mappings().first()
+    uid = int(uid)
+    user = _user_cache.get(uid)
+    if user is not None:
+        return user
+
+    row = (await db.execute(_STMT_USER_BY_ID, {"uid": uid})).scalar_one_or_none()
     if not row:
         raise HTTPException(status_code=401, detail="User not found")
 
-    return UserOut(
-        id=row["id"],
-        cafe_id=row["cafe_id"],
-        login=row["login"],
-        is_admin=bool(row["is_admin"]),
+    user = UserOut(
+        id=row.id,
+        cafe_id=row.cafe_id,
+        login=row.login,
+        is_admin=bool(row.is_admin),
     )
+    _user_cache[uid] = user
+    return user
 
 # =============== Pydantic Schemas ===============
 class ProductOut(BaseModel):
@@ -153,14 +295,28 @@ class OrderOut(BaseModel):
     status: str
     items: List[OrderItemOut]
 
+class OrderSummaryOut(BaseModel):
+    id: int
+    status: str
+    created_at: Optional[datetime]
+    total: float
+
 # =============== PDF helpers ===============
 def _invoice_path(order_id: int) -> str:
     return os.path.join(INVOICE_DIR, f"order_{order_id}.pdf")
 
+_FONTS_READY = False
+
 def _ensure_fonts():
     """
     Регистрирует DejaVuSans/DejaVuSans-Bold для корректной кириллицы.
+    Выполняется один раз при импорте модуля, дальше — no-op.
     """
+    global _FONTS_READY
+    if _FONTS_READY:
+        return
+    _FONTS_READY = True
+
     try:
         pdfmetrics.getFont("DejaVuSans")
         pdfmetrics.getFont("DejaVuSans-Bold")
@@ -189,25 +345,58 @@ def _ensure_fonts():
         pdfmetrics.registerFont(TTFont("DejaVuSans", reg))
         pdfmetrics.registerFont(TTFont("DejaVuSans-Bold", bold))
     else:
-        print("WARN: DejaVuSans(.ttf) не найден — кириллица в PDF может не печататься.")
+        logger.warning("DejaVuSans(.ttf) не найден — кириллица в PDF может не печататься.")
+
+_ensure_fonts()
 
-def generate_invoice_pdf(db: Session, order_id: int) -> str:
-    """Создаёт PDF-инвойс (с кириллицей и временем Алматы)."""
-    order = db.get(Order, order_id)
+# Названия кафе практически не меняются — кэшируем на процесс.
+# При появлении переименования кафе очищать через _cafe_name_cache.pop(cafe_id, None).
+_cafe_name_cache: LRUCache = LRUCache(maxsize=256)
+
+async def _cafe_name(db: AsyncSession, cafe_id: int) -> Optional[str]:
+    name = _cafe_name_cache.get(cafe_id)
+    if name is None:
+        name = (await db.execute(_STMT_CAFE_NAME, {"cafe_id": cafe_id})).scalar_one_or_none()
+        if name is not None:
+            _cafe_name_cache[cafe_id] = name
+    return name
+
+async def generate_invoice_pdf(
+    db: AsyncSession, order_id: int, output: Optional[BinaryIO] = None
+) -> Optional[str]:
+    """
+    Создаёт PDF-инвойс (с кириллицей и временем Алматы).
+    Без output — сохраняет в INVOICE_DIR и возвращает путь; с output — пишет туда, минуя диск.
+    """
+    order = await db.get(Order, order_id)
     if not order:
         raise ValueError("Order not found")
 
-    rows = (
-        db.query(OrderItem, Product)
-        .join(Product, OrderItem.product_id == Product.id)
-        .filter(OrderItem.order_id == order_id)
-        .all()
-    )
+    rows = (await db.execute(_STMT_INVOICE_ROWS, {"order_id": order_id})).all()
+    cafe_name = await _cafe_name(db, order.cafe_id)
+
+    # ReportLab синхронный — рисуем в отдельном потоке, чтобы не блокировать event loop
+    if output is not None:
+        await asyncio.to_thread(_render_invoice_pdf, order, cafe_name, rows, output)
+        return None
+    return await asyncio.to_thread(_save_invoice_pdf, order, cafe_name, rows, _invoice_path(order_id))
 
-    file_path = _invoice_path(order_id)
+def _save_invoice_pdf(order: Order, cafe_name: Optional[str], rows: list, file_path: str) -> str:
+    # пишем во временный файл и атомарно подменяем — get_invoice не увидит недописанный PDF
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        _render_invoice_pdf(order, cafe_name, rows, tmp_path)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return file_path
+
+def _render_invoice_pdf(order: Order, cafe_name: Optional[str], rows: list, output: Union[str, BinaryIO]) -> None:
+    """Рисует PDF по уже загруженным данным (без обращений к БД) в файл или file-like."""
     _ensure_fonts()
 
-    c = canvas.Canvas(file_path, pagesize=A4)
+    c = canvas.Canvas(output, pagesize=A4)
     w, h = A4
     y = h - 20 * mm
 
@@ -221,10 +410,9 @@ def generate_invoice_pdf(db: Session, order_id: int) -> str:
     y -= 6 * mm
 
     # Cafe name (если есть)
-    try:
-        cafe_name = db.execute(select(Cafe.name).where(Cafe.id == order.cafe_id)).scalar_one()
+    if cafe_name:
         c.drawString(20 * mm, y, f"Cafe: {cafe_name}")
-    except Exception:
+    else:
         c.drawString(20 * mm, y, f"Cafe ID: {order.cafe_id}")
     y -= 6 * mm
 
@@ -252,19 +440,19 @@ def generate_invoice_pdf(db: Session, order_id: int) -> str:
 
     c.setFont("DejaVuSans", 10)
     total = 0.0
-    for oi, p in rows:
-        line_total = float(oi.price) * oi.qty
+    for name, qty, price in rows:
+        price = float(price)
+        line_total = price * qty
         total += line_total
 
-        c.drawString(20 * mm, y, p.name[:50])
-        c.drawRightString(115 * mm, y, str(oi.qty))
-        c.drawRightString(140 * mm, y, f"{float(oi.price):.2f}")
+        c.drawString(20 * mm, y, name[:50])
+        c.drawRightString(115 * mm, y, str(qty))
+        c.drawRightString(140 * mm, y, f"{price:.2f}")
         c.drawRightString(190 * mm, y, f"{line_total:.2f}")
         y -= 6 * mm
 
         if y < 30 * mm:
             c.showPage()
-            _ensure_fonts()
             c.setFont("DejaVuSans", 10)
             y = h - 20 * mm
 
@@ -274,164 +462,228 @@ def generate_invoice_pdf(db: Session, order_id: int) -> str:
 
     c.showPage()
     c.save()
-    return file_path
+
+async def generate_invoice_pdf_safe(order_id: int) -> None:
+    """Фоновая генерация инвойса: своя сессия, ошибки только логируются."""
+    try:
+        async with AsyncSessionLocal() as db:
+            await generate_invoice_pdf(db, order_id)
+    except Exception:
+        logger.exception("PDF generation error for order %s", order_id)
+
+def _opaque_tag(tag: str) -> str:
+    return tag.strip().removeprefix("W/")
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match сравнивается слабо (RFC 9110): префикс W/ игнорируем с обеих сторон."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return _opaque_tag(etag) in {_opaque_tag(t) for t in if_none_match.split(",")}
 
 # =============== Endpoints ===============
 @app.get("/", tags=["health"])
-def root(db: Session = Depends(get_db)):
+async def root(db: AsyncSession = Depends(get_db)):
     # простая проверка соединения с БД
-    db.execute(select(Product.id).limit(1))
+    await db.execute(select(Product.id).limit(1))
     return {"message": "Bakery API is alive"}
 
 # --- Auth ---
 @app.post("/auth/login", response_model=TokenOut, tags=["auth"])
-def login(payload: LoginIn, db: Session = Depends(get_db)):
-    row = db.execute(select(CafeUsers).where(CafeUsers.c.login == payload.login)).mappings().first()
-    if not row:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    if not bcrypt.verify(payload.password, row["password_hash"]):
+async def login(payload: LoginIn, request: Request, db: AsyncSession = Depends(get_db)):
+    attempt_key = (payload.login, request.client.host if request.client else "")
+    if _login_blocked(attempt_key):
+        raise HTTPException(status_code=429, detail="Too many login attempts, try again later")
+
+    row = (await db.execute(_STMT_USER_BY_LOGIN, {"login": payload.login})).scalar_one_or_none()
+    # bcrypt — чистый CPU (~100 мс), выносим из event loop
+    if not row or not await asyncio.to_thread(verify_password, payload.password, row.password_hash):
+        _record_login_failure(attempt_key)
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    _login_failures.pop(attempt_key, None)
 
-    token = create_access_token({"sub": row["id"]})
+    token = create_access_token({"sub": str(row.id)})
     return TokenOut(access_token=token)
 
 @app.get("/auth/me", response_model=UserOut, tags=["auth"])
-def whoami(user: UserOut = Depends(get_current_user)):
+async def whoami(user: UserOut = Depends(get_current_user)):
     return user
 
 # --- Products ---
 @app.get("/products", response_model=List[ProductOut], tags=["products"])
-def list_products(db: Session = Depends(get_db)):
-    rows = (
-        db.execute(
-            select(
-                Product.id,
-                Product.name,
-                Product.price,
-                Inventory.qty,
-            )
-            .join(Inventory, Inventory.product_id == Product.id, isouter=True)
-            .order_by(Product.id)
-        ).all()
-    )
-    return [{"id": r[0], "name": r[1], "price": float(r[2] or 0), "stock": int(r[3] or 0)} for r in rows]
+async def list_products(db: AsyncSession = Depends(get_db)):
+    # NULL-ы закрываем в SQL, строки отдаём как есть — Pydantic сам приведёт типы
+    return (await db.execute(_STMT_PRODUCTS)).mappings().all()
 
 # --- Orders ---
 @app.post("/orders", response_model=OrderOut, status_code=201, tags=["orders"])
-def create_order(payload: OrderCreateIn, db: Session = Depends(get_db), user: UserOut = Depends(get_current_user)):
+async def create_order(payload: OrderCreateIn, db: AsyncSession = Depends(get_db), user: UserOut = Depends(get_current_user)):
     if not payload.items:
         raise HTTPException(status_code=400, detail="Items required")
 
     # Проверка продуктов
     product_ids = {it.product_id for it in payload.items}
-    products = {p.id: p for p in db.execute(select(Product).where(Product.id.in_(product_ids))).scalars().all()}
+    products = {
+        p.id: p
+        for p in (
+            await db.execute(select(Product.id, Product.name, Product.price).where(Product.id.in_(product_ids)))
+        ).all()
+    }
     if len(products) != len(product_ids):
         missing = sorted(product_ids - set(products.keys()))
         raise HTTPException(status_code=400, detail=f"Products not found: {missing}")
 
     order = Order(cafe_id=user.cafe_id, status=OrderStatus.pending, comment=payload.comment or "")
     db.add(order)
-    db.flush()
+    await db.flush()
+
+    # все позиции одним INSERT (executemany) вместо db.add на каждую
+    await db.execute(
+        insert(OrderItem),
+        [
+            {"order_id": order.id, "product_id": it.product_id, "qty": it.qty, "price": products[it.product_id].price}
+            for it in payload.items
+        ],
+    )
 
-    for it in payload.items:
-        db.add(OrderItem(order_id=order.id, product_id=it.product_id, qty=it.qty, price=products[it.product_id].price))
+    await db.commit()
 
-    db.commit()
-    db.refresh(order)
+    # ответ собираем из payload и уже загруженных продуктов — без повторного чтения заказа
+    out_items = [
+        OrderItemOut(product_id=it.product_id, name=products[it.product_id].name, qty=it.qty)
+        for it in payload.items
+    ]
 
-    out_items = []
-    for oi in order.items:
-        name = db.get(Product, oi.product_id).name
-        out_items.append(OrderItemOut(product_id=oi.product_id, name=name, qty=oi.qty))
+    return OrderOut(id=order.id, cafe_id=user.cafe_id, status=OrderStatus.pending.value, items=out_items)
 
-    return OrderOut(id=order.id, cafe_id=order.cafe_id, status=order.status.value, items=out_items)
+# с response_model FastAPI сериализует ответ сразу в JSON-байты через Pydantic (быстрый путь)
+@app.get("/orders/my", response_model=List[OrderSummaryOut], tags=["orders"])
+async def list_my_orders(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    before_id: Optional[int] = Query(None, ge=1, description="Keyset-пагинация: заказы с id < before_id (page игнорируется)"),
+    db: AsyncSession = Depends(get_db),
+    user: UserOut = Depends(get_current_user),
+):
+    # заказы страницы вместе с суммой — одним запросом с GROUP BY
+    stmt = (
+        select(
+            Order.id,
+            Order.status,
+            Order.created_at,
+            func.coalesce(func.sum(OrderItem.price * OrderItem.qty), 0).label("total"),
+        )
+        .join(OrderItem, OrderItem.order_id == Order.id, isouter=True)
+        .where(Order.cafe_id == user.cafe_id)
+        .group_by(Order.id)
+        .order_by(Order.id.desc())
+        .limit(page_size)
+    )
+    if before_id is not None:
+        # по индексу (cafe_id, id DESC), без перебора пропущенных строк как у OFFSET
+        stmt = stmt.where(Order.id < before_id)
+    else:
+        stmt = stmt.offset((page - 1) * page_size)
+    rows = (await db.execute(stmt)).all()
+
+    return [
+        {
+            "id": oid,
+            "status": getattr(st, "value", st),
+            "created_at": created_at,
+            "total": round(float(total), 2),
+        }
+        for oid, st, created_at, total in rows
+    ]
 
 @app.post("/orders/{order_id}/confirm", tags=["orders"])
-def confirm_order(order_id: int, db: Session = Depends(get_db), user: UserOut = Depends(get_current_user)):
-    order = db.execute(
-        select(Order).where(Order.id == order_id, Order.cafe_id == user.cafe_id)
+async def confirm_order(
+    order_id: int,
+    background: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+    user: UserOut = Depends(get_current_user),
+):
+    order = (
+        await db.execute(_STMT_ORDER_WITH_ITEMS, {"order_id": order_id, "cafe_id": user.cafe_id})
     ).scalar_one_or_none()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     if order.status != OrderStatus.pending:
         raise HTTPException(status_code=400, detail="Order not in pending state")
 
-    # списываем остаток
+    # статус меняем условным UPDATE: из двух параллельных confirm пройдёт только один
+    res = await db.execute(_STMT_CONFIRM_ORDER, {"order_id": order_id})
+    if res.rowcount == 0:
+        raise HTTPException(status_code=400, detail="Order not in pending state")
+
+    # списываем остаток одним UPDATE на позицию: проверка и списание атомарны (без SELECT и гонок)
     for it in order.items:
-        inv = db.execute(select(Inventory).where(Inventory.product_id == it.product_id)).scalar_one_or_none()
-        if not inv or inv.qty < it.qty:
-            raise HTTPException(status_code=409, detail=f"Insufficient stock for product_id={it.product_id}")
-        inv.qty -= it.qty
+        res = await db.execute(_STMT_TAKE_STOCK, {"b_product_id": it.product_id, "b_qty": it.qty})
+        if res.rowcount == 0:
+            # detail собираем до rollback: после него объекты сессии expired, а ленивой загрузки в async нет
+            detail = f"Insufficient stock for product_id={it.product_id}"
+            await db.rollback()
+            raise HTTPException(status_code=409, detail=detail)
 
-    order.status = OrderStatus.confirmed
-    db.commit()
+    await db.commit()
 
-    # создаем/обновляем PDF
-    try:
-        generate_invoice_pdf(db, order_id)
-    except Exception as e:
-        print(f"PDF generation error for order {order_id}: {e}")
+    # создаем/обновляем PDF после ответа; get_invoice догенерирует сам, если файл ещё не готов
+    background.add_task(generate_invoice_pdf_safe, order_id)
 
-    return {"ok": True, "status": order.status.value, "invoice_url": f"/orders/{order_id}/invoice"}
+    return {"ok": True, "status": OrderStatus.confirmed.value, "invoice_url": f"/orders/{order_id}/invoice"}
 
 @app.get("/orders/{order_id}", response_model=OrderOut, tags=["orders"])
-def get_order(order_id: int, db: Session = Depends(get_db), user: UserOut = Depends(get_current_user)):
-    order = db.execute(
-        select(Order).where(Order.id == order_id, Order.cafe_id == user.cafe_id)
+async def get_order(order_id: int, db: AsyncSession = Depends(get_db), user: UserOut = Depends(get_current_user)):
+    order = (
+        await db.execute(_STMT_ORDER_WITH_PRODUCTS, {"order_id": order_id, "cafe_id": user.cafe_id})
     ).scalar_one_or_none()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    out_items = []
-    for oi in order.items:
-        name = db.get(Product, oi.product_id).name
-        out_items.append(OrderItemOut(product_id=oi.product_id, name=name, qty=oi.qty))
+    out_items = [
+        OrderItemOut(product_id=oi.product_id, name=oi.product.name, qty=oi.qty)
+        for oi in order.items
+    ]
 
     return OrderOut(id=order.id, cafe_id=order.cafe_id, status=order.status.value, items=out_items)
 
 @app.get("/orders/{order_id}/invoice", summary="Скачать PDF-инвойс", tags=["orders"])
-def get_invoice(order_id: int, db: Session = Depends(get_db), user: UserOut = Depends(get_current_user)):
-    order = db.execute(
-        select(Order).where(Order.id == order_id, Order.cafe_id == user.cafe_id)
+async def get_invoice(
+    order_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    user: UserOut = Depends(get_current_user),
+):
+    found = (
+        await db.execute(_STMT_ORDER_EXISTS, {"order_id": order_id, "cafe_id": user.cafe_id})
     ).scalar_one_or_none()
-    if not order:
+    if not found:
         raise HTTPException(status_code=404, detail="Order not found")
 
     path = _invoice_path(order_id)
     if not os.path.exists(path):
-        generate_invoice_pdf(db, order_id)
-
-    return FileResponse(path, media_type="application/pdf", filename=f"invoice_order_{order_id}.pdf")
-
-@app.get("/orders/my", tags=["orders"])
-def list_my_orders(
-    page: int = Query(1, ge=1),
-    page_size: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db),
-    user: UserOut = Depends(get_current_user),
-):
-    offset = (page - 1) * page_size
-    rows = db.execute(
-        select(Order.id, Order.status, Order.created_at)
-        .where(Order.cafe_id == user.cafe_id)
-        .order_by(Order.id.desc())
-        .offset(offset)
-        .limit(page_size)
-    ).all()
-
-    # считаем total для каждого заказа
-    result = []
-    for oid, st, created_at in rows:
-        total = db.execute(
-            select(OrderItem.price, OrderItem.qty).where(OrderItem.order_id == oid)
-        ).all()
-        s = sum(float(p) * q for p, q in total)
-        result.append(
-            {
-                "id": oid,
-                "status": getattr(st, "value", st),
-                "created_at": created_at,
-                "total": round(s, 2),
-            }
+        # файла ещё нет (не подтверждён или фоновая генерация не успела) — рисуем в память и отдаём сразу;
+        # на диск инвойс пишет только confirm_order
+        buf = io.BytesIO()
+        await generate_invoice_pdf(db, order_id, output=buf)
+        return Response(
+            content=buf.getvalue(),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="invoice_order_{order_id}.pdf"'},
         )
-    return result
+
+    # PDF меняется только при перегенерации — клиент может переспросить через If-None-Match
+    st = os.stat(path)
+    etag = f'W/"{order_id}-{int(st.st_mtime)}-{st.st_size}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        path,
+        media_type="application/pdf",
+        filename=f"invoice_order_{order_id}.pdf",
+        headers=headers,
+        stat_result=st,
+    )
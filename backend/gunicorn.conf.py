@@ -0,0 +1,44 @@
+# backend/gunicorn.conf.py
+# Прод-запуск: gunicorn -c backend/gunicorn.conf.py backend.app:app
+# (в Docker-образе — из каталога backend: gunicorn -c gunicorn.conf.py app:app)
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('API_PORT', '8000')}"
+
+# 2*CPU+1 процессов, но не больше, чем позволяет общий бюджет соединений:
+# каждый воркер держит свой пул БД, минимум 2 соединения (см. backend/db.py, те же значения по умолчанию)
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", 120))
+DB_MIN_CONNECTIONS_PER_WORKER = 2
+workers = int(
+    os.environ.get(
+        "WEB_CONCURRENCY",
+        min(multiprocessing.cpu_count() * 2 + 1, DB_MAX_CONNECTIONS // DB_MIN_CONNECTIONS_PER_WORKER),
+    )
+)
+# uvicorn[standard] ставит uvloop и httptools, UvicornWorker подхватывает их сам
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# приложение (ReportLab, шрифты, движок БД) импортируется один раз в мастере до fork;
+# соединения к БД создаются лениво, уже в воркерах
+preload_app = True
+
+timeout = 60
+keepalive = 5
+
+
+def on_starting(server):
+    # итоговое число воркеров (с учётом -w в командной строке) проверяем до запуска
+    total = server.cfg.workers
+    if total * DB_MIN_CONNECTIONS_PER_WORKER > DB_MAX_CONNECTIONS:
+        raise RuntimeError(
+            f"{total} workers need at least {total * DB_MIN_CONNECTIONS_PER_WORKER} DB connections, "
+            f"but DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS}; lower -w/WEB_CONCURRENCY or raise the budget"
+        )
+
+
+def post_fork(server, worker):
+    # с preload_app движок создан в мастере до хуков — делим бюджет на итоговое число воркеров
+    from backend.db import configure_pool
+
+    configure_pool(server.cfg.workers)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Numeric, Enum, UniqueConstraint, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Numeric, Enum, UniqueConstraint, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy import DateTime
@@ -46,7 +46,7 @@ class Order(Base):
 class OrderItem(Base):
     __tablename__ = "order_items"
     id = Column(Integer, primary_key=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     qty = Column(Integer, nullable=False)
     price = Column(Numeric(10, 2), nullable=False)  # ← обязательно
@@ -55,6 +55,14 @@ class OrderItem(Base):
     product = relationship("Product")
 
 
+# --- Индексы под горячие запросы ---
+# DDL для БД — backend/sql/001_order_indexes.sql (create_all не используется, применять вручную)
+# список заказов кафе: WHERE cafe_id=? ORDER BY id DESC (без filesort)
+Index("ix_orders_cafe_id_id", Order.cafe_id, Order.id.desc())
+# позиции заказа (+ product_id для join с products); заменяет одиночный индекс по order_id
+Index("ix_order_items_order_id_product", OrderItem.order_id, OrderItem.product_id)
+
+
 # --- Учётная запись пользователя кафе ---
 class CafeUser(Base):
     __tablename__ = "cafe_users"
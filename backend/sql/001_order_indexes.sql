@@ -0,0 +1,13 @@
+-- backend/sql/001_order_indexes.sql
+-- Индексы под горячие запросы (см. Index(...) в backend/models.py).
+-- Схема ведётся вручную, create_all/миграций нет — применить один раз на существующей БД:
+--   mysql -u bakery -p bakery < backend/sql/001_order_indexes.sql
+
+-- list_my_orders: WHERE cafe_id=? ORDER BY id DESC LIMIT ... — без filesort
+CREATE INDEX ix_orders_cafe_id_id ON orders (cafe_id, id DESC);
+
+-- позиции заказа + join с products
+CREATE INDEX ix_order_items_order_id_product ON order_items (order_id, product_id);
+-- одиночный индекс по order_id — префикс составного, только лишняя запись на каждый INSERT;
+-- удаляем после создания составного (FK на orders обслуживает уже он)
+DROP INDEX ix_order_items_order_id ON order_items;